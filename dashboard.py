@@ -1,238 +1,821 @@
 import http.server
 import json
 import os
-import datetime
 import sqlite3
+import threading
+import time
 import io
-import base64
 import urllib.parse
+import atexit
+import shutil
+import tempfile
+import email.utils
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 
-# Set Matplotlib to non-interactive (backend 'Agg') for server use
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import numpy as np
+
+# orjson parses snapshots several times faster; stdlib json is the fallback
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # Configuration
 PORT = int(os.environ.get("PORT", 8080))
+# Charts are written as SVG directly by default; "png" renders them with matplotlib
+CHART_FORMAT = os.environ.get("CHART_FORMAT", "svg").strip().lower()
+if CHART_FORMAT not in ("svg", "png"):
+    print(f"[Dashboard Warning] Unknown CHART_FORMAT {CHART_FORMAT!r}, using svg")
+    CHART_FORMAT = "svg"
+HTTP_WORKERS = 8
 DATA_DIR = os.environ.get("VOLUME_DIR", "/mnt/data/")
 DB_PATH = os.path.join(DATA_DIR, "history.db")
 
+if CHART_FORMAT == "png":
+    # Matplotlib is driven through the object API (Figure + Agg canvas), no pyplot
+    import matplotlib
+    import matplotlib.dates as mdates
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # Dark theme and rendering settings applied once, so figures need no per-plot restyling.
+    # Path simplification / chunking cut the vertex count fed to Agg on long series.
+    matplotlib.rcParams.update({
+        'figure.facecolor': '#252526',
+        'axes.facecolor': '#1e1e1e',
+        'axes.labelcolor': '#d4d4d4',
+        'axes.titlecolor': '#569cd6',
+        'axes.grid': True,
+        'grid.color': '#333',
+        'grid.linestyle': '--',
+        'xtick.color': '#d4d4d4',
+        'ytick.color': '#d4d4d4',
+        'legend.facecolor': '#252526',
+        'legend.edgecolor': '#444',
+        'legend.labelcolor': '#d4d4d4',
+        'path.simplify': True,
+        'path.simplify_threshold': 1.0,
+        'agg.path.chunksize': 10000,
+        'lines.antialiased': False,
+    })
+
+# --- Static page chrome (encoded once at import) ---
+HEAD_BYTES = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Kraken Monitor</title>
+    <meta http-equiv="refresh" content="60">
+    <style>
+        body { font-family: monospace; background: #1e1e1e; color: #d4d4d4; padding: 20px; }
+        h1, h2 { color: #569cd6; border-bottom: 1px solid #333; padding-bottom: 5px; }
+        .card { background: #252526; padding: 15px; margin-bottom: 20px; border-radius: 5px; border: 1px solid #333; }
+        .chart { max_width: 100%; height: auto; display: block; margin: 10px 0; border: 1px solid #333; }
+        .nav { margin-bottom: 20px; }
+        .nav a { margin-right: 10px; color: #d4d4d4; text-decoration: none; padding: 5px 10px; border: 1px solid #444; border-radius: 3px; }
+        .nav a.active { background: #0e639c; border-color: #0e639c; }
+        table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+        th { text-align: left; border-bottom: 1px solid #444; color: #ce9178; padding: 5px; }
+        td { border-bottom: 1px solid #333; padding: 5px; }
+    </style>
+</head>
+<body>
+    <h1>Live Monitor Dashboard</h1>
+""".encode("utf-8")
+
+TAIL_BYTES = b"</body></html>"
+
+RANGE_OPTIONS = ((24, "1 Day"), (72, "3 Days"), (168, "7 Days"))
+
+def _build_nav(current_range):
+    links = "".join(
+        f'<a href="/?range={hours}" class="{"active" if hours == current_range else ""}">{label}</a>'
+        for hours, label in RANGE_OPTIONS
+    )
+    return f'<div class="nav"><span>Time Range: </span>{links}</div>'.encode("utf-8")
+
+# One pre-built nav bar per range; unknown ranges get the variant with no active link
+NAV_BYTES = {hours: _build_nav(hours) for hours, _ in RANGE_OPTIONS}
+NAV_BYTES_DEFAULT = _build_nav(None)
+
+# --- HTML Escaping (single C-level pass per value) ---
+_HTML_TR = str.maketrans({'<': '&lt;', '>': '&gt;', '&': '&amp;', '"': '&quot;'})
+
+def esc(x):
+    return str(x).translate(_HTML_TR)
+
+# --- Row Renderers (compiled once per snapshot schema) ---
+_ROW_RENDERERS = {}
+_ROW_RENDERERS_MAX = 32
+
+def _row_renderer(keys):
+    """Returns rows -> '<tr>...</tr>...' specialised for a tuple of column keys.
+
+    The first time a schema is seen, a function with the columns inlined as one
+    f-string is generated via exec, so the hot row loop has no inner key loop.
+    Unseen schemas beyond the cap get a generic (uncompiled) renderer instead.
+    """
+    render = _ROW_RENDERERS.get(keys)
+    if render is None and len(_ROW_RENDERERS) >= _ROW_RENDERERS_MAX:
+        return lambda rows: "".join(
+            "<tr>" + "".join(f"<td>{esc(r.get(k, ''))}</td>" for k in keys) + "</tr>" for r in rows)
+    if render is None:
+        cells = "".join(f"<td>{{esc(r.get(K[{i}], ''))}}</td>" for i in range(len(keys)))
+        code = f'def render(rows):\n    return "".join(f"<tr>{cells}</tr>" for r in rows)\n'
+        namespace = {"esc": esc, "K": keys}
+        exec(code, namespace)
+        render = _ROW_RENDERERS[keys] = namespace["render"]
+    return render
+
+# --- SQLite Connection (one long-lived read connection per thread) ---
+_tls = threading.local()
+
+def _conn():
+    """Returns this thread's SQLite connection, opening and tuning it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        _tls.conn = conn
+    return conn
+
+# --- History Window (incremental reads of per-minute rollups) ---
+ROLLUP_SECONDS = 60
+_BUCKET_US = ROLLUP_SECONDS * 1_000_000
+
+# Each query returns one row per time bucket (bucket start in epoch us) newer
+# than :since, in time order. Equity keeps avg/min/max; positions and signals
+# keep the last value in the bucket (SQLite takes bare columns from the MAX row).
+# equity_log rows are runs of one value (ts_us..end_us), plotted at both ends.
+_HISTORY_QUERIES = (
+    f"""SELECT (t / {_BUCKET_US}) * {_BUCKET_US} AS bucket, AVG(equity), MIN(equity), MAX(equity)
+        FROM (SELECT ts_us AS t, equity FROM equity_log WHERE ts_us > :since
+              UNION ALL
+              SELECT end_us, equity FROM equity_log WHERE end_us > :since AND end_us > ts_us)
+        GROUP BY bucket ORDER BY bucket ASC""",
+    f"""SELECT (ts_us / {_BUCKET_US}) * {_BUCKET_US} AS bucket, symbol, size, MAX(ts_us)
+        FROM position_log WHERE ts_us > :since GROUP BY bucket, symbol ORDER BY bucket ASC""",
+    f"""SELECT (ts_us / {_BUCKET_US}) * {_BUCKET_US} AS bucket, asset, tf, signal_val, MAX(ts_us)
+        FROM signal_log WHERE ts_us > :since GROUP BY bucket, asset, tf ORDER BY bucket ASC""",
+)
+# The equity run in progress at :since, whose points may both lie outside a window starting there
+_EQUITY_AT_QUERY = "SELECT equity FROM equity_log WHERE ts_us <= :since AND end_us > :since LIMIT 1"
+
+# Row layouts of the three history queries, held as NumPy structured arrays
+_EQ_DTYPE = np.dtype([('ts', 'i8'), ('equity', 'f8'), ('low', 'f8'), ('high', 'f8')])
+_POS_DTYPE = np.dtype([('ts', 'i8'), ('symbol', 'U32'), ('size', 'f8'), ('last_us', 'i8')])
+_SIG_DTYPE = np.dtype([('ts', 'i8'), ('asset', 'U32'), ('tf', 'U16'), ('val', 'f8'), ('last_us', 'i8')])
+_HISTORY_DTYPES = (_EQ_DTYPE, _POS_DTYPE, _SIG_DTYPE)
+
+# One window covering the longest range serves every range. "arrays" holds the
+# (equity, positions, signals) rollups as structured arrays.
+HISTORY_SPAN_HOURS = max(hours for hours, _ in RANGE_OPTIONS)
+_HISTORY = {"arrays": None}
+_HISTORY_LOCK = threading.Lock()
+
+def _fetch_array(cursor, query, since, dtype):
+    """Runs a history query and streams its rows straight into a structured array (no row list)."""
+    return np.fromiter(cursor.execute(query, {"since": since}), dtype=dtype)
+
+def _equity_at(cursor, at_us):
+    """Returns the value of the equity run spanning at_us, or None."""
+    row = cursor.execute(_EQUITY_AT_QUERY, {"since": at_us}).fetchone()
+    return row[0] if row else None
+
+def _clip_equity(eq, cutoff_us, value):
+    """Starts equity rollups at the cutoff's bucket with value, unless a bucket is already there.
+
+    A run that began before the cutoff may have no point inside the window
+    (flat equity would draw as nothing); this gives it one at the window start.
+    """
+    edge_us = cutoff_us - cutoff_us % _BUCKET_US
+    if value is None or (len(eq) and eq['ts'][0] <= edge_us): return eq
+    return np.concatenate((np.array([(edge_us, value, value, value)], dtype=_EQ_DTYPE), eq))
+
+def refresh_history():
+    """Pulls new rollup rows into the shared window (one set of queries per tick).
+
+    Only the newest (possibly partial) bucket onwards is re-fetched and
+    converted to arrays; buckets that fell out of the window are sliced off the
+    front, so held rows are never walked in Python again.
+    """
+    with _HISTORY_LOCK:
+        if not os.path.exists(DB_PATH):
+            _HISTORY["arrays"] = None
+            return
+
+        c = _conn().cursor()
+
+        # Timestamps are integer epoch microseconds (ts_us)
+        cutoff_us = int((time.time() - HISTORY_SPAN_HOURS * 3600) * 1_000_000)
+
+        held = _HISTORY["arrays"] or tuple(np.empty(0, dtype=dtype) for dtype in _HISTORY_DTYPES)
+        arrays = []
+        for query, dtype, arr in zip(_HISTORY_QUERIES, _HISTORY_DTYPES, held):
+            # The last held bucket may still be filling up: drop it and
+            # re-aggregate it together with anything newer.
+            since = cutoff_us
+            if len(arr):
+                last_bucket = int(arr['ts'][-1])
+                arr = arr[:np.searchsorted(arr['ts'], last_bucket, side='left')]
+                since = max(cutoff_us, last_bucket - 1)
+            fresh = _fetch_array(c, query, since, dtype)
+
+            # Keep every bucket that ends after the cutoff
+            start = np.searchsorted(arr['ts'], cutoff_us - _BUCKET_US, side='right')
+            joined = np.concatenate((arr[start:], fresh))
+            if dtype is _EQ_DTYPE:
+                # Full loads look up the run at the cutoff; later refreshes carry
+                # the average of the last bucket that slid out of the window
+                if not len(arr): carried = _equity_at(c, cutoff_us)
+                else: carried = arr['equity'][start - 1] if start else None
+                joined = _clip_equity(joined, cutoff_us, carried)
+            arrays.append(joined)
+
+        _HISTORY["arrays"] = tuple(arrays)
+
+def _get_historical_data(hours):
+    """Returns (equity, positions, signals) rollup arrays within the last X hours.
+
+    Ranges up to HISTORY_SPAN_HOURS are O(log n) slices of the shared window;
+    longer ranges query SQLite directly.
+    """
+    cutoff_us = int((time.time() - hours * 3600) * 1_000_000)
+
+    if hours > HISTORY_SPAN_HOURS:
+        if not os.path.exists(DB_PATH): return None, None, None
+        c = _conn().cursor()
+        equity, positions, signals = (
+            _fetch_array(c, query, cutoff_us, dtype)
+            for query, dtype in zip(_HISTORY_QUERIES, _HISTORY_DTYPES)
+        )
+        return _clip_equity(equity, cutoff_us, _equity_at(c, cutoff_us)), positions, signals
+
+    if _HISTORY["arrays"] is None:
+        refresh_history()
+    arrays = _HISTORY["arrays"]
+    if arrays is None: return None, None, None
+
+    # Keep every bucket that ends after the cutoff
+    starts = [np.searchsorted(arr['ts'], cutoff_us - _BUCKET_US, side='right') for arr in arrays]
+    equity, positions, signals = (arr[i:] for arr, i in zip(arrays, starts))
+
+    # Carry the average of the last equity bucket before the cutoff to the
+    # range start, so a run that started before the range still draws
+    i = starts[0]
+    carried = arrays[0]['equity'][i - 1] if i else None
+    return _clip_equity(equity, cutoff_us, carried), positions, signals
+
+# Charts are viewed in a browser and re-rendered every refresh: a lower DPI and
+# a light zlib level encode much faster for a few extra KB.
+PNG_DPI = 80
+_PNG_PIL_KWARGS = {"compress_level": 3, "optimize": False}
+
+def _figure():
+    """Returns this thread's reusable (Figure, Axes) pair, creating it on first use."""
+    pair = getattr(_tls, "figure", None)
+    if pair is None:
+        fig = Figure(figsize=(10, 4), dpi=PNG_DPI)
+        FigureCanvasAgg(fig)
+        pair = (fig, fig.add_subplot())
+        _tls.figure = pair
+    return pair
+
+def _generate_plot_png(title, series, type='line'):
+    """Generates a Matplotlib plot and returns the PNG bytes.
+
+    series maps label -> (times, values) or (times, values, lows, highs); the
+    optional lows/highs are drawn as a shaded min-max band behind the line.
+    """
+    # Styling comes from rcParams, which ax.clear() restores
+    fig, ax = _figure()
+    ax.clear()
+    ax.set_title(title)
+
+    # Plotting: arrays go straight to matplotlib, no per-point Python objects
+    for label, (xs, ys, *band) in series.items():
+        if band:
+            ax.fill_between(xs, band[0], band[1], alpha=0.25, linewidth=0)
+        if type == 'step':
+            ax.step(xs, ys, label=label, where='post')
+        else:
+            ax.plot(xs, ys, label=label)
+
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
+    ax.tick_params(axis='x', labelrotation=45)
+
+    if len(series) > 1:
+        ax.legend()
+
+    # Save to buffer
+    buf = io.BytesIO()
+    fig.tight_layout()
+    fig.canvas.print_png(buf, pil_kwargs=_PNG_PIL_KWARGS)
+    return buf.getvalue()
+
+# --- SVG Charts (default renderer, no matplotlib) ---
+SVG_WIDTH, SVG_HEIGHT = 1000, 400
+_SVG_MARGIN = (70, 20, 35, 75)  # left, right, top, bottom
+_SERIES_COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                  '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
+
+def _scale(values, lo, hi, out_lo, out_hi):
+    """Linearly maps values from [lo, hi] onto [out_lo, out_hi] (centred if the range is empty)."""
+    if hi == lo:
+        return np.full(len(values), (out_lo + out_hi) / 2)
+    return out_lo + (values - lo) * ((out_hi - out_lo) / (hi - lo))
+
+def _svg_points(px, py):
+    return " ".join(f"{x:.1f},{y:.1f}" for x, y in zip(px.tolist(), py.tolist()))
+
+def _generate_plot_svg(title, series, type='line'):
+    """Writes a line/step chart as a standalone SVG document and returns its bytes.
+
+    Takes the same series mapping as _generate_plot_png; timestamps are mapped
+    to pixels with NumPy and each series becomes one <polyline>/<path>.
+    """
+    left, right, top, bottom = _SVG_MARGIN
+    px_lo, px_hi = left, SVG_WIDTH - right
+    py_lo, py_hi = SVG_HEIGHT - bottom, top  # SVG y grows downwards
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SVG_WIDTH} {SVG_HEIGHT}" '
+        f'width="{SVG_WIDTH}" height="{SVG_HEIGHT}" font-family="monospace" font-size="12">',
+        f'<rect width="{SVG_WIDTH}" height="{SVG_HEIGHT}" fill="#252526"/>',
+        f'<rect x="{px_lo}" y="{py_hi}" width="{px_hi - px_lo}" height="{py_lo - py_hi}" fill="#1e1e1e" stroke="#444"/>',
+        f'<text x="{SVG_WIDTH / 2}" y="22" fill="#569cd6" text-anchor="middle" font-size="15">{esc(title)}</text>',
+    ]
+
+    # Shared axis ranges across all series (bands included), with a 5% value margin
+    prepared = [
+        (label, xs.astype('datetime64[us]').astype(np.int64), ys, band)
+        for label, (xs, ys, *band) in series.items() if len(xs)
+    ]
+    if prepared:
+        t_lo = min(int(ts[0]) for _, ts, _, _ in prepared)
+        t_hi = max(int(ts[-1]) for _, ts, _, _ in prepared)
+        v_lo = min(float(np.min([ys.min()] + [b.min() for b in band])) for _, _, ys, band in prepared)
+        v_hi = max(float(np.max([ys.max()] + [b.max() for b in band])) for _, _, ys, band in prepared)
+        pad = (v_hi - v_lo) * 0.05 or 1.0
+        v_lo, v_hi = v_lo - pad, v_hi + pad
+
+        # Grid + tick labels
+        for v in np.linspace(v_lo, v_hi, 5):
+            y = float(_scale(np.array([v]), v_lo, v_hi, py_lo, py_hi)[0])
+            parts.append(f'<line x1="{px_lo}" y1="{y:.1f}" x2="{px_hi}" y2="{y:.1f}" stroke="#333" stroke-dasharray="4 3"/>')
+            parts.append(f'<text x="{px_lo - 6}" y="{y + 4:.1f}" fill="#d4d4d4" text-anchor="end">{v:.6g}</text>')
+        for t in np.linspace(t_lo, t_hi, 6):
+            x = float(_scale(np.array([t]), t_lo, t_hi, px_lo, px_hi)[0])
+            label = time.strftime('%m-%d %H:%M', time.gmtime(t / 1e6))
+            parts.append(f'<line x1="{x:.1f}" y1="{py_hi}" x2="{x:.1f}" y2="{py_lo}" stroke="#333" stroke-dasharray="4 3"/>')
+            parts.append(f'<text x="{x:.1f}" y="{py_lo + 14}" fill="#d4d4d4" text-anchor="end" '
+                         f'transform="rotate(-45 {x:.1f} {py_lo + 14})">{label}</text>')
+
+        # Series
+        for i, (label, ts, ys, band) in enumerate(prepared):
+            color = _SERIES_COLORS[i % len(_SERIES_COLORS)]
+            px = _scale(ts, t_lo, t_hi, px_lo, px_hi)
+            py = _scale(ys, v_lo, v_hi, py_lo, py_hi)
+            if band:
+                lows = _scale(band[0], v_lo, v_hi, py_lo, py_hi)
+                highs = _scale(band[1], v_lo, v_hi, py_lo, py_hi)
+                outline = _svg_points(np.concatenate([px, px[::-1]]), np.concatenate([highs, lows[::-1]]))
+                parts.append(f'<polygon points="{outline}" fill="{color}" fill-opacity="0.25"/>')
+            if type == 'step':
+                d = f"M{px[0]:.1f},{py[0]:.1f}" + "".join(
+                    f"H{x:.1f}V{y:.1f}" for x, y in zip(px[1:].tolist(), py[1:].tolist())
+                )
+                parts.append(f'<path d="{d}" fill="none" stroke="{color}" stroke-width="1.5"/>')
+            else:
+                parts.append(f'<polyline points="{_svg_points(px, py)}" fill="none" stroke="{color}" stroke-width="1.5"/>')
+
+        # Legend (top-right, inside the plot area)
+        if len(prepared) > 1:
+            width = 40 + 8 * max(len(label) for label, *_ in prepared)
+            lx = px_hi - width - 8
+            parts.append(f'<rect x="{lx}" y="{py_hi + 8}" width="{width}" height="{16 * len(prepared) + 8}" '
+                         f'fill="#252526" stroke="#444"/>')
+            for i, (label, *_) in enumerate(prepared):
+                color = _SERIES_COLORS[i % len(_SERIES_COLORS)]
+                y = py_hi + 24 + 16 * i
+                parts.append(f'<line x1="{lx + 6}" y1="{y - 4}" x2="{lx + 26}" y2="{y - 4}" stroke="{color}" stroke-width="2"/>')
+                parts.append(f'<text x="{lx + 32}" y="{y}" fill="#d4d4d4">{esc(label)}</text>')
+
+    parts.append('</svg>')
+    return "".join(parts).encode("utf-8")
+
+_generate_plot = _generate_plot_png if CHART_FORMAT == "png" else _generate_plot_svg
+_CHART_CONTENT_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+
+def _to_times(ts_us):
+    """Epoch microseconds -> datetime64 array (plotted natively by matplotlib)."""
+    return ts_us.astype('datetime64[us]')
+
+# "Asset (TF)" legend labels, built once per distinct pair rather than per row
+_SIGNAL_LABELS = {}
+
+def _signal_label(key):
+    asset_tf = key.item()
+    label = _SIGNAL_LABELS.get(asset_tf)
+    if label is None:
+        label = _SIGNAL_LABELS[asset_tf] = f"{asset_tf[0]} ({asset_tf[1]})"
+    return label
+
+def _group_series(keys, ts_us, values, label=str):
+    """Splits parallel arrays into {label(key): (times, values)}, preserving time order per key.
+
+    keys may be a multi-field structured array, in which case rows group by the
+    field tuple.
+    """
+    order = np.argsort(keys, kind='stable')
+    uniq, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    times = _to_times(ts_us)
+    return {
+        label(key): (times[order[s:e]], values[order[s:e]])
+        for key, s, e in zip(uniq, starts, ends)
+    }
+
+# --- Downsampling (a chart is ~1000px wide; more points than that are never seen) ---
+MAX_PLOT_POINTS = 500
+
+def _downsample_band(ts_us, values, lows, highs):
+    """Merges runs of consecutive buckets down to at most MAX_PLOT_POINTS.
+
+    Each merged point keeps the mean value and the min/max envelope of its run.
+    """
+    n = len(ts_us)
+    if n <= MAX_PLOT_POINTS: return ts_us, values, lows, highs
+    starts = np.arange(0, n, -(-n // MAX_PLOT_POINTS))
+    counts = np.diff(np.append(starts, n))
+    return (ts_us[starts], np.add.reduceat(values, starts) / counts,
+            np.minimum.reduceat(lows, starts), np.maximum.reduceat(highs, starts))
+
+def _change_points(xs, ys):
+    """Drops the interior points of flat runs; the line or step drawn through the rest is identical."""
+    if len(ys) < 3: return xs, ys
+    keep = np.ones(len(ys), dtype=bool)
+    keep[1:-1] = (ys[1:-1] != ys[:-2]) | (ys[1:-1] != ys[2:])
+    return xs[keep], ys[keep]
+
+# Charts in page order; each one is served as /chart/<name>.<CHART_FORMAT>
+CHART_NAMES = ("equity", "positions", "signals")
+
+def _build_charts(hours, names=CHART_NAMES):
+    """Queries history for the last X hours and renders the named charts as {name: chart_bytes}."""
+    eq, pos, sig = _get_historical_data(hours)
+    if eq is None or not len(eq): return {}
+    charts = {}
+
+    # Process Equity (per-minute average with its min/max band)
+    if "equity" in names:
+        ts, equity, low, high = _downsample_band(eq['ts'], eq['equity'], eq['low'], eq['high'])
+        equity_data = {"Total Equity": (_to_times(ts), equity, low, high)}
+        charts["equity"] = _generate_plot("Margin Equity", equity_data)
+
+    # Process Positions (one series per symbol)
+    # Sizes and signals change rarely: only the points where they change are drawn
+    if "positions" in names:
+        pos_data = _group_series(pos['symbol'], pos['ts'], pos['size'])
+        pos_data = {label: _change_points(*xy) for label, xy in pos_data.items()}
+        charts["positions"] = _generate_plot("Positions Size Over Time", pos_data)
+
+    # Process Signals (one series per "Asset (TF)")
+    if "signals" in names:
+        sig_data = _group_series(sig[['asset', 'tf']], sig['ts'], sig['val'], label=_signal_label)
+        sig_data = {label: _change_points(*xy) for label, xy in sig_data.items()}
+        charts["signals"] = _generate_plot("Signals Over Time", sig_data, type='step')
+
+    return charts
+
+# --- Chart Cache (rendered off the request path) ---
+# Each standard range maps to (tick, {name: file_path}, last_modified); the tick
+# bumps on every regeneration and doubles as the ETag for the served images. Rendered charts
+# live in a temp dir (tmpfs on most hosts, never the data volume) so they can be
+# sent to the socket with sendfile.
+CHART_REFRESH_SECONDS = 30
+CHART_MAX_AGE = 20
+CHART_CACHE = {hours: None for hours, _ in RANGE_OPTIONS}
+CHART_LOCK = threading.RLock()
+PLOT_DIR = tempfile.mkdtemp(prefix="kraken-charts-")
+atexit.register(shutil.rmtree, PLOT_DIR, True)
+_chart_tick = 0
+_chart_data_version = None
+
+def _store_charts(hours, charts):
+    """Writes rendered charts to PLOT_DIR and publishes their paths under a new tick."""
+    global _chart_tick
+    paths = {}
+    for name, image in charts.items():
+        path = os.path.join(PLOT_DIR, f"{hours}-{name}.{CHART_FORMAT}")
+        # Replace atomically: a request already sending the old file keeps its open fd.
+        # Each writer gets its own temp file, since the refresher and a request
+        # filling a cold cache can store the same range at once.
+        fd, tmp = tempfile.mkstemp(dir=PLOT_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f: f.write(image)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        paths[name] = path
+    with CHART_LOCK:
+        _chart_tick += 1
+        CHART_CACHE[hours] = (_chart_tick, paths, email.utils.formatdate(usegmt=True))
+        return CHART_CACHE[hours]
+
+def _get_charts(hours, names=CHART_NAMES):
+    """Returns (tick, charts, last_modified) for a range, from cache where possible.
+
+    Cached charts are file paths. Non-standard ranges are rendered on demand
+    (only the charts in names), returned as in-memory bytes and get a tick of
+    None (uncacheable).
+    """
+    with CHART_LOCK:
+        cached = CHART_CACHE.get(hours)
+    if cached is not None:
+        return cached
+
+    # Cache not filled yet: render the whole range synchronously once
+    if hours in CHART_CACHE:
+        return _store_charts(hours, _build_charts(hours))
+    return None, _build_charts(hours, names), None
+
+def _render_charts(hours):
+    """Returns the encoded <img> fragment pointing at the served chart images."""
+    if hours in CHART_CACHE:
+        names = [name for name, image in _get_charts(hours)[1].items() if image]
+        if not names: return b"<p class='empty'>No historical data yet.</p>"
+    else:
+        # Uncached range: each image request renders its own chart, so
+        # rendering them here as well would only be thrown away
+        names = CHART_NAMES
+    return "".join(
+        f'<img src="/chart/{name}.{CHART_FORMAT}?range={hours}" class="chart"/>'
+        for name in names
+    ).encode("utf-8")
+
+def _data_version():
+    """Returns a key that changes whenever the monitor commits to the database.
+
+    data_version is only comparable on one connection, so the key carries which.
+    """
+    if not os.path.exists(DB_PATH): return None
+    conn = _conn()
+    return id(conn), conn.execute("PRAGMA data_version").fetchone()[0]
+
+def refresh_charts():
+    """Refreshes the shared history window once, then re-renders every cached range.
+
+    Skipped entirely while the database has not been written since the last run.
+    """
+    global _chart_data_version
+    version = _data_version()
+    with CHART_LOCK:
+        filled = all(cached is not None for cached in CHART_CACHE.values())
+    if filled and version is not None and version == _chart_data_version:
+        return
+    refresh_history()
+    for hours in list(CHART_CACHE):
+        _store_charts(hours, _build_charts(hours))
+    _chart_data_version = version
+
+# Set by the monitor after each snapshot so charts are re-rendered right away
+# instead of on the next CHART_REFRESH_SECONDS tick
+_HISTORY_CHANGED = threading.Event()
+
+def notify_history_changed():
+    """Wakes the chart refresher; main.py hands this to the monitor loop."""
+    _HISTORY_CHANGED.set()
+
+def _chart_refresher():
+    while True:
+        # Cleared before rendering so a snapshot landing mid-render triggers another pass
+        _HISTORY_CHANGED.clear()
+        try:
+            refresh_charts()
+        except Exception as e:
+            print(f"[Chart Error] {e}")
+        _HISTORY_CHANGED.wait(CHART_REFRESH_SECONDS)
+
+# --- Response Framing (Server/Date block rebuilt once per second, not per request) ---
+SERVER_VERSION = "KrakenMonitor/1.0"
+_STATUS_LINES = {
+    status: f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode("latin-1")
+    for status in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED)
+}
+_PAGE_HEADERS = b"Content-type: text/html\r\nTransfer-Encoding: chunked\r\n"
+
+def _format_common_headers():
+    http_date = email.utils.formatdate(usegmt=True)
+    return http_date, f"Server: {SERVER_VERSION}\r\nDate: {http_date}\r\n".encode("latin-1")
+
+_http_date, _common_headers = _format_common_headers()
+
+def _date_ticker():
+    global _http_date, _common_headers
+    while True:
+        time.sleep(1)
+        _http_date, _common_headers = _format_common_headers()
+
+# --- Snapshot Cache (one parsed entry per snapshot file, keyed by mtime) ---
+_JSON_CACHE = {}
+_JSON_LOCK = threading.Lock()
+
+def _snapshot_section(snapshot, key):
+    """Returns one section of snapshot.json in the {last_updated, data} shape the tables take."""
+    if not snapshot or key not in snapshot.get("data", {}): return None
+    return {"last_updated": snapshot["last_updated"], "data": snapshot["data"][key]}
+
 class RequestHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 is required for chunked page responses (and enables keep-alive)
+    protocol_version = "HTTP/1.1"
+    # An idle keep-alive connection holds one of the HTTP_WORKERS until it times
+    # out, so keep this short: long enough for a page's chart requests to reuse
+    # the connection, short enough that idle browsers can't starve the pool
+    timeout = 2
+
+    def log_message(self, format, *args):
+        pass
+
+    def version_string(self):
+        return SERVER_VERSION
+
+    def date_time_string(self, timestamp=None):
+        return _http_date if timestamp is None else super().date_time_string(timestamp)
+
+    def _send_head(self, status, headers=b""):
+        """Writes the status line, cached Server/Date block and extra headers in one write."""
+        self.wfile.write(_STATUS_LINES[status] + _common_headers + headers + b"\r\n")
+
     def _read_json(self, filename):
         filepath = os.path.join(DATA_DIR, filename)
-        if not os.path.exists(filepath): return None
+        try: st = os.stat(filepath)
+        except OSError: return None
+
+        # Reuse the parsed snapshot until the monitor rewrites the file
+        key = (st.st_mtime_ns, st.st_size)
+        with _JSON_LOCK:
+            cached = _JSON_CACHE.get(filepath)
+        if cached and cached[0] == key: return cached[1]
+
         try:
-            with open(filepath, "r") as f: return json.load(f)
+            with open(filepath, "rb") as f: data = _json_loads(f.read())
         except: return None
+        with _JSON_LOCK:
+            _JSON_CACHE[filepath] = (key, data)
+        return data
 
-    def _get_historical_data(self, hours):
-        """Query SQLite for data within the last X hours."""
-        if not os.path.exists(DB_PATH): return None, None, None
-        
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
-        
-        # Fetch Equity
-        c.execute("SELECT timestamp, equity FROM equity_log WHERE timestamp > ? ORDER BY timestamp ASC", (cutoff,))
-        equity_rows = c.fetchall()
-        
-        # Fetch Positions
-        c.execute("SELECT timestamp, symbol, size FROM position_log WHERE timestamp > ? ORDER BY timestamp ASC", (cutoff,))
-        pos_rows = c.fetchall()
-        
-        # Fetch Signals
-        c.execute("SELECT timestamp, asset, tf, signal_val FROM signal_log WHERE timestamp > ? ORDER BY timestamp ASC", (cutoff,))
-        sig_rows = c.fetchall()
-        
-        conn.close()
-        return equity_rows, pos_rows, sig_rows
-
-    def _generate_plot_base64(self, title, x_data, y_dict, type='line', ylabel='Value'):
-        """Generates a Matplotlib plot and returns a base64 HTML image string."""
-        if not x_data: return ""
-        
-        fig, ax = plt.subplots(figsize=(10, 4))
-        fig.patch.set_facecolor('#252526')
-        ax.set_facecolor('#1e1e1e')
-        
-        # Styling
-        ax.tick_params(axis='x', colors='#d4d4d4')
-        ax.tick_params(axis='y', colors='#d4d4d4')
-        ax.xaxis.label.set_color('#d4d4d4')
-        ax.yaxis.label.set_color('#d4d4d4')
-        ax.set_title(title, color='#569cd6')
-        ax.grid(True, color='#333', linestyle='--')
-        
-        # Plotting
-        for label, y_vals in y_dict.items():
-            # Align lengths (basic forward fill logic might be needed for perfect sync, but this is a quick vis)
-            # Ensure x and y match for this specific series
-            # For simplicity in this structure: assume x_data is global time, y_vals are sparse. 
-            # Better approach: Plot (x,y) pairs directly.
-            
-            if isinstance(y_vals, list) and isinstance(y_vals[0], tuple):
-                # (timestamp, value) list
-                xs = [v[0] for v in y_vals]
-                ys = [v[1] for v in y_vals]
-                if type == 'step':
-                    ax.step(xs, ys, label=label, where='post')
-                else:
-                    ax.plot(xs, ys, label=label)
-            
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d %H:%M'))
-        plt.xticks(rotation=45)
-        
-        if len(y_dict) > 1:
-            ax.legend(facecolor='#252526', edgecolor='#444', labelcolor='#d4d4d4')
-
-        # Save to buffer
-        buf = io.BytesIO()
-        plt.tight_layout()
-        plt.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        img_str = base64.b64encode(buf.read()).decode('utf-8')
-        return f'<img src="data:image/png;base64,{img_str}" class="chart"/>'
-
-    def _render_charts(self, hours):
-        eq_rows, pos_rows, sig_rows = self._get_historical_data(hours)
-        if not eq_rows: return "<p class='empty'>No historical data yet.</p>"
-        
-        # Process Equity
-        # Convert strings to datetime objects
-        eq_times = [datetime.datetime.fromisoformat(r[0]) for r in eq_rows]
-        eq_vals = [r[1] for r in eq_rows]
-        # Pack into structure expected by plotter
-        equity_data = {"Total Equity": list(zip(eq_times, eq_vals))}
-        
-        html = self._generate_plot_base64("Margin Equity", eq_times, equity_data)
-        
-        # Process Positions
-        pos_data = {}
-        for r in pos_rows:
-            ts = datetime.datetime.fromisoformat(r[0])
-            sym = r[1]
-            size = r[2]
-            if sym not in pos_data: pos_data[sym] = []
-            pos_data[sym].append((ts, size))
-            
-        html += self._generate_plot_base64("Positions Size Over Time", eq_times, pos_data)
-        
-        # Process Signals (Filtered to prevent clutter, maybe combine Asset+TF)
-        sig_data = {}
-        for r in sig_rows:
-            ts = datetime.datetime.fromisoformat(r[0])
-            key = f"{r[1]} ({r[2]})" # Asset (TF)
-            val = r[3]
-            if key not in sig_data: sig_data[key] = []
-            sig_data[key].append((ts, val))
-            
-        html += self._generate_plot_base64("Signals Over Time", eq_times, sig_data, type='step')
-        
-        return html
-
-    def _html_template(self, body_content, current_range):
-        return f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Kraken Monitor</title>
-            <meta http-equiv="refresh" content="60"> 
-            <style>
-                body {{ font-family: monospace; background: #1e1e1e; color: #d4d4d4; padding: 20px; }}
-                h1, h2 {{ color: #569cd6; border-bottom: 1px solid #333; padding-bottom: 5px; }}
-                .card {{ background: #252526; padding: 15px; margin-bottom: 20px; border-radius: 5px; border: 1px solid #333; }}
-                .chart {{ max_width: 100%; height: auto; display: block; margin: 10px 0; border: 1px solid #333; }}
-                .nav {{ margin-bottom: 20px; }}
-                .nav a {{ margin-right: 10px; color: #d4d4d4; text-decoration: none; padding: 5px 10px; border: 1px solid #444; border-radius: 3px; }}
-                .nav a.active {{ background: #0e639c; border-color: #0e639c; }}
-                table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
-                th {{ text-align: left; border-bottom: 1px solid #444; color: #ce9178; padding: 5px; }}
-                td {{ border-bottom: 1px solid #333; padding: 5px; }}
-            </style>
-        </head>
-        <body>
-            <h1>Live Monitor Dashboard</h1>
-            <div class="nav">
-                <span>Time Range: </span>
-                <a href="/?range=24" class="{ 'active' if current_range==24 else '' }">1 Day</a>
-                <a href="/?range=72" class="{ 'active' if current_range==72 else '' }">3 Days</a>
-                <a href="/?range=168" class="{ 'active' if current_range==168 else '' }">7 Days</a>
-            </div>
-            
-            <div class="card">
-                <h2>Historical Charts</h2>
-                {self._render_charts(current_range)}
-            </div>
-
-            {body_content}
-        </body>
-        </html>
-        """
+    def _render_heartbeat(self):
+        """Shows when the monitor last ran, which moves even while the snapshot is unchanged."""
+        try:
+            with open(os.path.join(DATA_DIR, "heartbeat")) as f: checked = f.read().strip()
+        except OSError: checked = "?"
+        return f"<p style='color:#6a9955'>Monitor last checked: {esc(checked)}</p>"
 
     def _render_dict_table(self, title, json_obj):
-        # (Same as your original function, kept for brevity)
         if not json_obj: return f"<div class='card'><h2>{title}</h2><p class='empty'>No data.</p></div>"
         last = json_obj.get("last_updated", "?")
         data = json_obj.get("data", {})
-        html = f"<div class='card'><h2>{title} <span style='font-size:0.8em; color:#6a9955'>({last})</span></h2>"
-        
+        parts = [f"<div class='card'><h2>{title} <span style='font-size:0.8em; color:#6a9955'>({esc(last)})</span></h2>"]
+
         if isinstance(data, list) and data:
-            keys = data[0].keys()
-            html += "<table><thead><tr>" + "".join([f"<th>{k}</th>" for k in keys]) + "</tr></thead><tbody>"
-            for item in data:
-                html += "<tr>" + "".join([f"<td>{item.get(k,'')}</td>" for k in keys]) + "</tr>"
-            html += "</tbody></table>"
+            keys = tuple(data[0].keys())
+            parts.append("<table><thead><tr>" + "".join(f"<th>{esc(k)}</th>" for k in keys) + "</tr></thead><tbody>")
+            parts.append(_row_renderer(keys)(data))
+            parts.append("</tbody></table>")
         elif isinstance(data, dict) and data:
-            html += "<table><thead><tr><th>Key</th><th>Value</th></tr></thead><tbody>"
-            for k,v in data.items():
-                disp = json.dumps(v) if isinstance(v, (dict,list)) else v
-                html += f"<tr><td>{k}</td><td>{disp}</td></tr>"
-            html += "</tbody></table>"
+            parts.append("<table><thead><tr><th>Key</th><th>Value</th></tr></thead><tbody>")
+            parts.extend(
+                f"<tr><td>{esc(k)}</td><td>{esc(json.dumps(v) if isinstance(v, (dict,list)) else v)}</td></tr>"
+                for k, v in data.items()
+            )
+            parts.append("</tbody></table>")
         else:
-            html += "<p>Empty.</p>"
-        html += "</div>"
-        return html
+            parts.append("<p>Empty.</p>")
+        parts.append("</div>")
+        return "".join(parts)
 
-    def do_GET(self):
-        parsed = urllib.parse.urlparse(self.path)
-        params = urllib.parse.parse_qs(parsed.query)
-        
-        # Default to 24 hours (1 day)
-        range_hours = int(params.get('range', [24])[0])
+    def _serve_chart(self, path, range_hours):
+        """Serves /chart/<name>.<svg|png> straight from the chart cache."""
+        name, ext = os.path.splitext(path[len("/chart/"):])
+        if ext != "." + CHART_FORMAT or name not in CHART_NAMES:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        tick, charts, modified = _get_charts(range_hours, (name,))
+        chart = charts.get(name)
+        if not chart:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        etag = f'"{range_hours}-{tick}"' if tick is not None else None
+        caching = (
+            f"ETag: {etag}\r\nLast-Modified: {modified}\r\nCache-Control: max-age={CHART_MAX_AGE}\r\n"
+            if etag else "Cache-Control: no-cache\r\n"
+        )
+        # If-None-Match wins over If-Modified-Since when a client sends both
+        if_none_match = self.headers.get("If-None-Match")
+        if etag and (if_none_match == etag if if_none_match is not None
+                     else self.headers.get("If-Modified-Since") == modified):
+            self._send_head(HTTPStatus.NOT_MODIFIED, caching.encode("latin-1"))
+            return
+
+        head = f"Content-type: {_CHART_CONTENT_TYPES[CHART_FORMAT]}\r\n{caching}"
+        if isinstance(chart, bytes):
+            self._send_head(HTTPStatus.OK, f"{head}Content-Length: {len(chart)}\r\n".encode("latin-1"))
+            self.wfile.write(chart)
+            return
 
-        portfolio = self._read_json("portfolio_snapshot.json")
-        positions = self._read_json("positions_snapshot.json")
-        signals = self._read_json("signals_snapshot.json")
+        with open(chart, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._send_head(HTTPStatus.OK, f"{head}Content-Length: {size}\r\n".encode("latin-1"))
+            # socket.sendfile uses os.sendfile (kernel zero-copy) and copes with the socket timeout
+            self.connection.sendfile(f, 0, size)
+
+    def _write_chunk(self, data):
+        """Writes one HTTP/1.1 chunk (empty data would end the stream, so skip it)."""
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _page_chunks(self, range_hours):
+        """Yields the page piece by piece so the head goes out before charts and tables are ready."""
+        yield HEAD_BYTES
+        yield NAV_BYTES.get(range_hours, NAV_BYTES_DEFAULT)
+        yield self._render_heartbeat().encode("utf-8")
+        yield b"<div class='card'><h2>Historical Charts</h2>" + _render_charts(range_hours) + b"</div>"
+
+        # One snapshot file holds all three sections, written together by the monitor
+        snapshot = self._read_json("snapshot.json")
 
-        body = ""
         # 1. Portfolio Table
+        portfolio = _snapshot_section(snapshot, "portfolio")
         if portfolio and "accounts" in portfolio.get("data", {}):
-             body += self._render_dict_table("Portfolio Balances", {"last_updated": portfolio["last_updated"], "data": portfolio["data"]["accounts"]})
+             yield self._render_dict_table("Portfolio Balances", {"last_updated": portfolio["last_updated"], "data": portfolio["data"]["accounts"]}).encode("utf-8")
         else:
-             body += self._render_dict_table("Portfolio Balances", portfolio)
+             yield self._render_dict_table("Portfolio Balances", portfolio).encode("utf-8")
 
         # 2. Positions Table
+        positions = _snapshot_section(snapshot, "positions")
         if positions and "openPositions" in positions.get("data", {}):
-             body += self._render_dict_table("Open Positions", {"last_updated": positions["last_updated"], "data": positions["data"]["openPositions"]})
+             yield self._render_dict_table("Open Positions", {"last_updated": positions["last_updated"], "data": positions["data"]["openPositions"]}).encode("utf-8")
         else:
-             body += self._render_dict_table("Open Positions", positions)
+             yield self._render_dict_table("Open Positions", positions).encode("utf-8")
 
         # 3. Signals Table
-        body += self._render_dict_table("Signals (Live)", signals)
+        yield self._render_dict_table("Signals (Live)", _snapshot_section(snapshot, "signals")).encode("utf-8")
+
+        yield TAIL_BYTES
+
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(parsed.query)
+        
+        # Default to 24 hours (1 day)
+        range_hours = int(params.get('range', [24])[0])
+
+        if parsed.path.startswith("/chart/"):
+            self._serve_chart(parsed.path, range_hours)
+            return
+
+        self._send_head(HTTPStatus.OK, _PAGE_HEADERS)
+        for chunk in self._page_chunks(range_hours):
+            self._write_chunk(chunk)
+        self.wfile.write(b"0\r\n\r\n")
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer that hands connections to a fixed worker pool instead of a new thread each.
+
+    Workers are long-lived, so their thread-local SQLite connections survive
+    across requests.
+    """
+    def __init__(self, *args, max_workers=HTTP_WORKERS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
 
-        self.send_response(HTTPStatus.OK)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(self._html_template(body, range_hours).encode("utf-8"))
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
 
 def run():
+    threading.Thread(target=_chart_refresher, daemon=True).start()
+    threading.Thread(target=_date_ticker, daemon=True).start()
     print(f"Server on {PORT}")
-    http.server.ThreadingHTTPServer(("", PORT), RequestHandler).serve_forever()
+    PooledHTTPServer(("", PORT), RequestHandler).serve_forever()
 
 if __name__ == "__main__":
     run()
@@ -6,6 +6,7 @@ Kraken-Futures API client.
 import base64
 import hashlib
 import hmac
+import threading
 import time
 import urllib.parse
 from typing import Dict, Any, Optional
@@ -19,21 +20,28 @@ class KrakenFuturesApi:
         api_key: str,
         api_secret: str,
         base_url: str = "https://futures.kraken.com",
+        timeout: float = 10,
     ) -> None:
         self.api_key = api_key
         self.api_secret = api_secret
         self.base_url = base_url.rstrip("/")
+        # Seconds to wait for the connection and for each read; without it a
+        # stalled call never returns
+        self.timeout = timeout
         self._nonce_counter = 0
+        # Requests may be issued from several threads at once
+        self._nonce_lock = threading.Lock()
 
     # ------------------------------------------------------------------
     # low-level helpers
     # ------------------------------------------------------------------
     def _create_nonce(self) -> str:
-        if self._nonce_counter > 9_999:
-            self._nonce_counter = 0
-        counter_str = f"{self._nonce_counter:05d}"
-        self._nonce_counter += 1
-        return f"{int(time.time() * 1_000)}{counter_str}"
+        with self._nonce_lock:
+            if self._nonce_counter > 9_999:
+                self._nonce_counter = 0
+            counter_str = f"{self._nonce_counter:05d}"
+            self._nonce_counter += 1
+            return f"{int(time.time() * 1_000)}{counter_str}"
 
     def _sign_request(self, endpoint: str, nonce: str, post_data: str = "") -> str:
         # strip '/derivatives' prefix if present
@@ -84,7 +92,7 @@ class KrakenFuturesApi:
 
         headers["Authent"] = self._sign_request(endpoint, nonce, post_data_for_sig)
 
-        rsp = requests.request(method, url, headers=headers, data=data_payload)
+        rsp = requests.request(method, url, headers=headers, data=data_payload, timeout=self.timeout)
         if not rsp.ok:
             raise RuntimeError(f"{method} {endpoint} failed : {rsp.text}")
         return rsp.json()
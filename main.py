@@ -12,7 +12,8 @@ def start_monitor():
     """Runs the monitoring loop safely."""
     print("[System] Starting Background Monitor...")
     try:
-        monitor.main()
+        # Charts re-render as soon as a new snapshot lands
+        monitor.main(on_history_saved=dashboard.notify_history_changed)
     except Exception as e:
         print(f"[System] Monitor Thread Crashed: {e}", file=sys.stderr)
 
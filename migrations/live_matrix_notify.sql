@@ -0,0 +1,15 @@
+-- One-time migration for the signals database: NOTIFY 'matrix_update' on every
+-- change to live_matrix, so the monitor only re-queries the table after it changed.
+-- Run once with a role that may create triggers on live_matrix:
+--   psql "$DATABASE_URL" -f migrations/live_matrix_notify.sql
+-- The monitor never creates this itself; without it, it polls live_matrix every loop.
+
+CREATE OR REPLACE FUNCTION live_matrix_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('matrix_update', '');
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS live_matrix_notify ON live_matrix;
+CREATE TRIGGER live_matrix_notify AFTER INSERT OR UPDATE OR DELETE ON live_matrix
+    FOR EACH STATEMENT EXECUTE PROCEDURE live_matrix_notify();
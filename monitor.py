@@ -2,11 +2,22 @@ import os
 import time
 import json
 import datetime
+import hashlib
 import sqlite3
+import queue
+import threading
 import psycopg2
+import psycopg2.extras
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from typing import List, Dict, Any
 
+# orjson serializes datetimes natively and several times faster; stdlib json is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Import your library
 from kraken_futures import KrakenFuturesApi
 
@@ -18,181 +29,442 @@ VOLUME_DIR = os.getenv("VOLUME_DIR", "/mnt/data")
 DB_PATH = os.path.join(VOLUME_DIR, "history.db")
 INTERVAL_SECONDS = 20
 RETENTION_DAYS = 7
+PRUNE_INTERVAL_SECONDS = 3600
+PRUNE_BATCH_ROWS = 5000
+# Unchanged history is still written this often so charts keep reaching "now"
+HISTORY_KEEPALIVE_SECONDS = 300
+FETCH_TIMEOUT_SECONDS = 10
+
+# The per-loop fetches (Kraken, signals DB) are network-bound, so they run side by side
+_EXEC = ThreadPoolExecutor(max_workers=2)
+
+def now_epoch_us() -> int:
+    """Current time as integer epoch microseconds (the history tables' ts_us)."""
+    return time.time_ns() // 1000
 
 # --- Database Management ---
-def init_db():
-    """Initializes the SQLite database for historical tracking."""
+# Insert statements kept as constants: identical SQL text hits the connection's
+# statement cache, so they are parsed and planned once per process.
+INS_EQUITY = "INSERT INTO equity_log (equity, ts_us) VALUES (?, ?)"
+# equity_log is run-length encoded: a sample equal to the newest row only moves
+# that row's end_us forward (rowcount 0 means a new run must be inserted)
+EXT_EQUITY = "UPDATE equity_log SET end_us = ? WHERE rowid = (SELECT MAX(rowid) FROM equity_log) AND equity = ?"
+INS_POS = "INSERT INTO position_log (symbol, size, side, ts_us) VALUES (?, ?, ?, ?)"
+INS_SIG = "INSERT INTO signal_log (asset, tf, signal_val, ts_us) VALUES (?, ?, ?, ?)"
+
+def connect_db():
+    """Opens history.db in WAL mode with relaxed fsync (one WAL append per commit)."""
+    # Opened by main, then used only by the writer thread
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=134217728")
+    return conn
+
+def init_db() -> sqlite3.Connection:
+    """Initializes the SQLite database for historical tracking.
+
+    Returns the open connection; the monitor keeps it for its whole lifetime.
+    """
     # Ensure volume directory exists
     if not os.path.exists(VOLUME_DIR):
         os.makedirs(VOLUME_DIR, exist_ok=True)
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
     
-    # 1. Equity History
+    # 1. Equity History (one row per run of identical samples, ts_us..end_us)
+    # Times are INTEGER epoch microseconds (ts_us): 8 bytes, plain integer compares
     c.execute('''CREATE TABLE IF NOT EXISTS equity_log (
-                    timestamp DATETIME,
-                    equity REAL
+                    equity REAL,
+                    ts_us INTEGER,
+                    end_us INTEGER
                 )''')
     
     # 2. Positions History
     c.execute('''CREATE TABLE IF NOT EXISTS position_log (
-                    timestamp DATETIME,
                     symbol TEXT,
                     size REAL,
-                    side TEXT
+                    side TEXT,
+                    ts_us INTEGER
                 )''')
 
     # 3. Signals History
     c.execute('''CREATE TABLE IF NOT EXISTS signal_log (
-                    timestamp DATETIME,
                     asset TEXT,
                     tf TEXT,
-                    signal_val INTEGER
+                    signal_val INTEGER,
+                    ts_us INTEGER
                 )''')
+
+    # Indexes on the old text timestamp go first (DROP COLUMN refuses indexed columns)
+    for old_index in ("idx_equity_ts", "idx_pos_ts", "idx_sig_ts", "idx_pos_ts_sym", "idx_sig_ts_at",
+                      "idx_equity_ts_us", "idx_equity_end_us", "idx_pos_ts_us_sym", "idx_sig_ts_us_at"):
+        c.execute(f"DROP INDEX IF EXISTS {old_index}")
+
+    # Migration: older databases only have the ISO text timestamp. Add the
+    # integer epoch-microsecond column, backfill it from the text value, then
+    # drop the text column (a one-off table rewrite).
+    for table in ("equity_log", "position_log", "signal_log"):
+        columns = [row[1] for row in c.execute(f"PRAGMA table_info({table})")]
+        if "ts_us" not in columns:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN ts_us INTEGER")
+            c.execute(f"""UPDATE {table} SET ts_us =
+                             CAST(strftime('%s', timestamp) AS INTEGER) * 1000000
+                             + CAST(substr(timestamp, 21, 6) AS INTEGER)""")
+        if "timestamp" in columns:
+            try:
+                c.execute(f"ALTER TABLE {table} DROP COLUMN timestamp")
+            except sqlite3.OperationalError as e:
+                # SQLite < 3.35: keep the column, it is simply left NULL from now on
+                print(f"[DB Warning] Could not drop {table}.timestamp: {e}")
+
+    # Migration: equity runs. Rows from before have no end (a one-sample run).
+    columns = [row[1] for row in c.execute("PRAGMA table_info(equity_log)")]
+    if "end_us" not in columns:
+        c.execute("ALTER TABLE equity_log ADD COLUMN end_us INTEGER")
     
     # Indexes for faster plotting queries
-    c.execute('CREATE INDEX IF NOT EXISTS idx_equity_ts ON equity_log (timestamp)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_pos_ts ON position_log (timestamp)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_sig_ts ON signal_log (timestamp)')
+    # Composite indexes lead with ts_us, so range scans return rows in
+    # ORDER BY order (no temp B-tree) and are plain integer compares. They also
+    # carry every column the dashboard's rollups read, so those queries (and the
+    # position/signal prune scans) are answered from index pages alone.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_equity_cover ON equity_log (ts_us, equity)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_equity_end_cover ON equity_log (end_us, ts_us, equity)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pos_cover ON position_log (ts_us, symbol, size)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_sig_cover ON signal_log (ts_us, asset, tf, signal_val)')
     
     conn.commit()
-    conn.close()
 
-def prune_old_data():
-    """Deletes data older than RETENTION_DAYS."""
+    # Refresh planner statistics once per process start
+    c.execute('ANALYZE')
+    conn.commit()
+    return conn
+
+# An equity run is only expired once it has also ended before the cutoff
+_PRUNE_CONDITIONS = {
+    "equity_log": "ts_us < :cutoff AND COALESCE(end_us, ts_us) < :cutoff",
+    "position_log": "ts_us < :cutoff",
+    "signal_log": "ts_us < :cutoff",
+}
+
+def prune_old_data(conn: sqlite3.Connection):
+    """Deletes data older than RETENTION_DAYS.
+
+    Each round deletes up to PRUNE_BATCH_ROWS rows from every table in one
+    transaction (one WAL commit for all three), so a large backlog never holds
+    one huge write transaction open.
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=RETENTION_DAYS)
-        
-        c.execute("DELETE FROM equity_log WHERE timestamp < ?", (cutoff,))
-        c.execute("DELETE FROM position_log WHERE timestamp < ?", (cutoff,))
-        c.execute("DELETE FROM signal_log WHERE timestamp < ?", (cutoff,))
-        
-        conn.commit()
-        conn.close()
+        cutoff_us = now_epoch_us() - RETENTION_DAYS * 86400 * 1_000_000
+
+        pending = dict(_PRUNE_CONDITIONS)
+        while pending:
+            with conn:
+                for table, expired in list(pending.items()):
+                    cur = conn.execute(f"""DELETE FROM {table} WHERE rowid IN
+                                               (SELECT rowid FROM {table} WHERE {expired} LIMIT {PRUNE_BATCH_ROWS})""",
+                                       {"cutoff": cutoff_us})
+                    # A short batch means this table has nothing older left
+                    if cur.rowcount < PRUNE_BATCH_ROWS: del pending[table]
+
+        conn.execute("PRAGMA optimize")
     except Exception as e:
         print(f"[Prune Error] {e}")
 
-def save_history_snapshot(portfolio, positions, signals):
-    """Parses raw API data and inserts into SQLite."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    now = datetime.datetime.utcnow()
+def extract_margin_equity(portfolio) -> float:
+    """Returns portfolio -> accounts -> flex -> marginEquity, or 0.0 when any level is missing.
 
-    # 1. Log Equity (Corrected Path)
-    # Path: portfolio -> accounts -> flex -> marginEquity
+    A present but non-numeric value still raises ValueError for the caller to log.
+    """
     try:
-        total_equity = 0.0
-        
-        # Navigate safely to ['accounts']['flex']
-        accounts = portfolio.get("accounts", {})
-        if isinstance(accounts, dict):
-            flex_wallet = accounts.get("flex", {})
-            # Get marginEquity, default to 0 if missing
-            total_equity = float(flex_wallet.get("marginEquity", 0))
-        
-        c.execute("INSERT INTO equity_log VALUES (?, ?)", (now, total_equity))
+        return float(portfolio["accounts"]["flex"]["marginEquity"])
+    except (KeyError, TypeError):
+        return 0.0
+
+# Values of the last history write, and digests of the last snapshot file contents
+_last_history = {"values": None, "ts_us": 0}
+_last_hashes = {}
+
+def save_history_snapshot(conn: sqlite3.Connection, portfolio, positions, signals, now_us=None):
+    """Parses raw API data and inserts it into SQLite in one transaction.
+
+    Skipped when every value matches the previous write, unless that write is
+    older than HISTORY_KEEPALIVE_SECONDS. A section that is None (its fetch
+    failed this loop) adds no rows.
+    """
+    if now_us is None: now_us = now_epoch_us()
+    equity_rows, pos_rows, sig_rows = [], [], []
+
+    # Parse first, so a malformed section only drops its own rows
+
+    # 1. Equity
+    try:
+        if portfolio is not None:
+            equity_rows = [(extract_margin_equity(portfolio), now_us)]
     except Exception as e:
         print(f"[Data Error] Could not parse equity: {e}")
 
-    # 2. Log Positions
+    # 2. Positions
     try:
-        open_positions = positions.get("openPositions", [])
-        for pos in open_positions:
-            c.execute("INSERT INTO position_log VALUES (?, ?, ?, ?)", 
-                      (now, pos.get("symbol"), float(pos.get("size", 0)), pos.get("side")))
+        if positions is not None:
+            pos_rows = [(pos.get("symbol"), float(pos.get("size", 0)), pos.get("side"), now_us)
+                        for pos in positions.get("openPositions", [])]
     except Exception as e:
         print(f"[Data Error] Could not parse positions: {e}")
 
-    # 3. Log Signals
+    # 3. Signals
     try:
-        for sig in signals:
-            c.execute("INSERT INTO signal_log VALUES (?, ?, ?, ?)", 
-                      (now, sig.get("asset"), sig.get("tf"), int(sig.get("signal_val", 0))))
+        if signals is not None:
+            sig_rows = [(sig.get("asset"), sig.get("tf"), int(sig.get("signal_val", 0)), now_us)
+                        for sig in signals]
     except Exception as e:
         print(f"[Data Error] Could not parse signals: {e}")
 
-    conn.commit()
-    conn.close()
+    # Row values without the timestamp (last column)
+    values = tuple(tuple(row[:-1] for row in rows) for rows in (equity_rows, pos_rows, sig_rows))
+    if (values == _last_history["values"]
+            and now_us - _last_history["ts_us"] < HISTORY_KEEPALIVE_SECONDS * 1_000_000):
+        return
+
+    # One transaction: a single WAL commit per snapshot
+    with conn:
+        for row in equity_rows:
+            if not conn.execute(EXT_EQUITY, (now_us, row[0])).rowcount:
+                conn.execute(INS_EQUITY, row)
+        conn.executemany(INS_POS, pos_rows)
+        conn.executemany(INS_SIG, sig_rows)
+    _last_history["values"] = values
+    _last_history["ts_us"] = now_us
 
-# --- Helper: JSON Encoder ---
-class CustomEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, (datetime.date, datetime.datetime)):
-            return obj.isoformat()
-        if isinstance(obj, Decimal):
-            return float(obj)
-        return super().default(obj)
+# --- Helper: JSON Serialization ---
+def _json_default(obj):
+    """default= hook for types the JSON encoder can't serialize (Decimal; dates for stdlib json)."""
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dump_json(data: Any) -> bytes:
+    """Serializes data to indented JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, default=_json_default, indent=2).encode("utf-8")
 
 def save_to_volume(filename: str, data: Any):
-    """Saves current snapshot JSON for the live dashboard view."""
+    """Saves current snapshot JSON for the live dashboard view.
+
+    The file is left alone while data is unchanged, so last_updated is the time
+    the data last changed; write_heartbeat records when it was last checked.
+    """
+    filepath = os.path.join(VOLUME_DIR, filename)
+    try:
+        digest = hashlib.blake2b(dump_json(data), digest_size=16).digest()
+        if _last_hashes.get(filename) == digest and os.path.exists(filepath):
+            return
+
+        wrapper = { "last_updated": datetime.datetime.utcnow().isoformat(), "data": data }
+        # Replace atomically so the dashboard never reads a half-written file
+        with open(filepath + ".tmp", "wb") as f:
+            f.write(dump_json(wrapper))
+        os.replace(filepath + ".tmp", filepath)
+        _last_hashes[filename] = digest
+    except Exception as e:
+        print(f"[Error] Failed to write {filename}: {e}")
+
+def write_heartbeat(filename: str = "heartbeat"):
+    """Stamps the time of this loop in a tiny file, kept apart from snapshot.json so its cache still hits."""
     filepath = os.path.join(VOLUME_DIR, filename)
-    wrapper = { "last_updated": datetime.datetime.utcnow().isoformat(), "data": data }
     try:
-        with open(filepath, "w") as f:
-            json.dump(wrapper, f, cls=CustomEncoder, indent=2)
+        with open(filepath + ".tmp", "w") as f:
+            f.write(datetime.datetime.utcnow().isoformat())
+        os.replace(filepath + ".tmp", filepath)
     except Exception as e:
         print(f"[Error] Failed to write {filename}: {e}")
 
+# --- Signals Database (one persistent connection, query prepared once) ---
+# A statement-level trigger (migrations/live_matrix_notify.sql, installed by
+# hand) NOTIFYs on every change to live_matrix, so the table is only
+# re-queried after it changed; without the trigger every loop re-queries.
+_DB_CONN = None
+_SIGNALS = {"rows": None, "listening": False}
+
+_NOTIFY_CHANNEL = "matrix_update"
+
+def _listen_for_changes(cursor) -> bool:
+    """LISTENs for live_matrix changes; False (poll instead) if the trigger isn't installed."""
+    try:
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'live_matrix_notify' AND tgrelid = 'live_matrix'::regclass")
+        if cursor.fetchone() is None:
+            print("[DB Warning] live_matrix_notify trigger not installed, polling live_matrix")
+            return False
+        cursor.execute(f"LISTEN {_NOTIFY_CHANNEL}")
+        return True
+    except psycopg2.Error as e:
+        print(f"[DB Warning] Change notifications unavailable, polling live_matrix: {e}")
+        return False
+
+def _get_signals_conn():
+    """Returns the live Postgres connection, reconnecting and re-preparing when needed."""
+    global _DB_CONN
+    if _DB_CONN is None or _DB_CONN.closed:
+        conn = psycopg2.connect(DATABASE_URL)
+        conn.set_session(autocommit=True)
+        if orjson is not None:
+            psycopg2.extras.register_default_json(conn, loads=orjson.loads)
+        with conn.cursor() as cursor:
+            # Postgres builds the row dicts itself and ships one JSON array;
+            # signal_val as float8 keeps Decimals out of the payload
+            cursor.execute("""PREPARE live_matrix_q AS
+                SELECT COALESCE(json_agg(json_build_object(
+                    'asset', asset, 'tf', tf, 'signal_val', signal_val::float8, 'updated_at', updated_at
+                )), '[]'::json) FROM live_matrix""")
+            _SIGNALS["listening"] = _listen_for_changes(cursor)
+        # Changes made while disconnected were never notified: query afresh
+        _SIGNALS["rows"] = None
+        _DB_CONN = conn
+    return _DB_CONN
+
 def fetch_signals_from_db() -> List[Dict]:
+    global _DB_CONN
     if not DATABASE_URL: return []
-    query = "SELECT asset, tf, signal_val, updated_at FROM live_matrix;"
-    results = []
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        for row in rows:
-            results.append({ "asset": row[0], "tf": row[1], "signal_val": row[2], "updated_at": row[3] })
-        cursor.close()
-        conn.close()
+        conn = _get_signals_conn()
+        # Collect pending NOTIFYs; with none, the last result is still current
+        conn.poll()
+        changed = bool(conn.notifies)
+        conn.notifies.clear()
+        if _SIGNALS["listening"] and not changed and _SIGNALS["rows"] is not None:
+            return _SIGNALS["rows"]
+
+        with conn.cursor() as cursor:
+            cursor.execute("EXECUTE live_matrix_q")
+            (results,) = cursor.fetchone()
+        _SIGNALS["rows"] = results
     except Exception as e:
         print(f"[DB Error] Could not fetch signals: {e}")
+        # Drop the connection; the next loop reconnects and prepares again
+        if _DB_CONN is not None:
+            try: _DB_CONN.close()
+            except Exception: pass
+            _DB_CONN = None
         return []
     return results
 
-def main():
+def _fetch_kraken(kraken):
+    """Fetches accounts, then open positions.
+
+    The two signed calls go one after the other: Kraken rejects a nonce that
+    arrives after a larger one, which concurrent requests can't rule out.
+    """
+    return kraken.get_accounts(), kraken.get_open_positions()
+
+def _fetch_result(future, label, default=None):
+    """Waits for one fetch; returns default (None: skip that source this loop) if it failed."""
+    try:
+        return future.result(timeout=FETCH_TIMEOUT_SECONDS)
+    except Exception as e:
+        print(f"[Fetch Error] {label}: {e}")
+        return default
+
+# --- Persistence (one writer thread owns the SQLite connection) ---
+# The fetch loop hands each result over and goes straight back to sleeping;
+# JSON and SQLite writes (and their fsyncs) happen on the writer thread.
+WRITE_Q = queue.Queue(maxsize=4)
+
+def _enqueue_write(item):
+    """Queues one loop's results, dropping the oldest pending one if the writer fell behind."""
+    while True:
+        try:
+            WRITE_Q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                WRITE_Q.get_nowait()
+                print("[Writer] Falling behind, dropped the oldest pending snapshot")
+            except queue.Empty:
+                pass
+
+def _writer_loop(db_conn, on_history_saved):
+    """Persists queued (portfolio, positions, signals, now_us) tuples until a None arrives.
+
+    A section that is None (its fetch failed) keeps its last value in the snapshot.
+    """
+    last_prune = 0.0
+    sections = {}
+    try:
+        while True:
+            item = WRITE_Q.get()
+            if item is None: return
+            portfolio_data, positions_data, signals_data, now_us = item
+
+            try:
+                # Snapshot (for current table view; one file, one write)
+                fetched = {"portfolio": portfolio_data, "positions": positions_data, "signals": signals_data}
+                sections.update((key, data) for key, data in fetched.items() if data is not None)
+                if sections: save_to_volume("snapshot.json", sections)
+                write_heartbeat()
+
+                # History (for plots)
+                save_history_snapshot(db_conn, portfolio_data, positions_data, signals_data, now_us)
+                if on_history_saved: on_history_saved()
+
+                # Prune old data (hourly; the window only moves by one loop in between)
+                if time.time() - last_prune >= PRUNE_INTERVAL_SECONDS:
+                    prune_old_data(db_conn)
+                    last_prune = time.time()
+            except Exception as e:
+                print(f"[Writer Error] {e}")
+    finally:
+        db_conn.close()
+
+def main(on_history_saved=None):
+    """Runs the monitor loop; on_history_saved is called after each history snapshot."""
     print("--- Starting Kraken Futures Monitor (with History) ---")
     
-    # Initialize SQLite
-    init_db()
+    # Initialize SQLite; the connection is handed to the writer thread for its lifetime
+    db_conn = init_db()
+    writer = threading.Thread(target=_writer_loop, args=(db_conn, on_history_saved), daemon=True)
+    writer.start()
 
-    kraken = KrakenFuturesApi(API_KEY, API_SECRET) if (API_KEY and API_SECRET) else None
+    # Both Kraken calls share one task, so each gets half the fetch timeout
+    kraken = (KrakenFuturesApi(API_KEY, API_SECRET, timeout=FETCH_TIMEOUT_SECONDS / 2)
+              if (API_KEY and API_SECRET) else None)
 
-    while True:
-        loop_start = time.time()
-        
-        portfolio_data = {}
-        positions_data = {}
-        signals_data = []
+    # Absolute deadlines keep samples exactly INTERVAL_SECONDS apart (no drift from wake-up jitter)
+    next_tick = time.monotonic()
 
-        try:
-            # 1. Fetch Data
-            if kraken:
-                portfolio_data = kraken.get_accounts()
-                positions_data = kraken.get_open_positions()
-            
-            signals_data = fetch_signals_from_db()
-
-            # 2. Save Snapshots (for current table view)
-            save_to_volume("portfolio_snapshot.json", portfolio_data)
-            save_to_volume("positions_snapshot.json", positions_data)
-            save_to_volume("signals_snapshot.json", signals_data)
-
-            # 3. Save History (for plots)
-            save_history_snapshot(portfolio_data, positions_data, signals_data)
-            
-            # 4. Prune old data
-            prune_old_data()
-
-        except Exception as e:
-            print(f"[Loop Error] {e}")
-
-        elapsed = time.time() - loop_start
-        time.sleep(max(0, INTERVAL_SECONDS - elapsed))
+    try:
+        while True:
+            try:
+                # 1. Fetch Data (concurrently: loop latency is the slowest call, not the sum)
+                f_kraken = _EXEC.submit(_fetch_kraken, kraken) if kraken else None
+                f_sig = _EXEC.submit(fetch_signals_from_db)
+
+                # Without API keys the Kraken sections are simply empty
+                portfolio_data, positions_data = (
+                    _fetch_result(f_kraken, "kraken", (None, None)) if f_kraken else ({}, {}))
+                signals_data = _fetch_result(f_sig, "signals")
+
+                # 2. Hand off snapshot + history writes, stamped with the fetch time
+                _enqueue_write((portfolio_data, positions_data, signals_data,
+                                now_epoch_us()))
+
+            except Exception as e:
+                print(f"[Loop Error] {e}")
+
+            next_tick += INTERVAL_SECONDS
+            now = time.monotonic()
+            if now - next_tick > INTERVAL_SECONDS:
+                # More than a whole tick behind (slow fetch, suspended host): resync
+                next_tick = now
+            time.sleep(max(0, next_tick - now))
+    finally:
+        # Let the writer drain what is queued, then close the connection
+        _enqueue_write(None)
+        writer.join(timeout=10)
 
 if __name__ == "__main__":
     main()